@@ -0,0 +1,371 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Deploys the hours of operation, contact flows and contact flow modules in a template created by
+# create-contact-flow-template.py directly to a Connect instance with the Connect APIs instead of CloudFormation.
+#
+# Resources are created or updated in waves.  Each wave runs concurrently and only contains resources whose
+# references have all been created.  Contact flows that reference each other are first created with placeholder
+# content, so every reference can be resolved.  Resources whose content has not changed are not updated, so
+# deploying the same template twice makes no changes.
+#
+# Everything goes through the Connect client that is passed in, so the deployment can be tested against a
+# stubbed client.  Use max_workers=1 for a predictable order of API calls.
+
+import json
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import pydash as _
+
+# Matches the variables of an Fn::Sub string.  ${!Literal} is not a variable.
+SUB_VARIABLE = re.compile(r'\$\{([^!}][^}]*)\}')
+
+CONTACT_FLOW_TYPES = ["AWS::Connect::ContactFlow", "AWS::Connect::ContactFlowModule"]
+
+
+# Returns the string of an Fn::Sub in either its short or its list form
+def get_sub_string(value):
+    sub = value["Fn::Sub"]
+    return sub[0] if isinstance(sub, list) else sub
+
+
+# Replaces the variables in an Fn::Sub the same way CloudFormation would
+def render_sub(value, variables):
+    def get_variable(match):
+        if match.group(1) not in variables:
+            raise Exception(f"The reference ${{{match.group(1)}}} can not be resolved")
+        return variables[match.group(1)]
+    return SUB_VARIABLE.sub(get_variable, get_sub_string(value)).replace("${!", "${")
+
+
+# Returns the names of the template resources referenced by a resource's content
+def get_dependencies(resource, resource_names):
+    if "Content" not in resource["Properties"]:
+        return set()
+    references = [variable.split(".")[0] for variable in SUB_VARIABLE.findall(get_sub_string(resource["Properties"]["Content"]))]
+    return set(reference for reference in references if reference in resource_names)
+
+
+# Returns the ARN of the Lambda function or Lex bot alias of a Custom::ConnectAssociateLambda or
+# Custom::ConnectAssociateLex resource, as it appears in the content of the contact flows that use it
+def get_association_arn(resource):
+    return get_sub_string(resource["Properties"].get("FunctionArn") or resource["Properties"]["AliasArn"])
+
+
+# Returns the resources that are part of a cycle of references, including resources that reference themselves.
+# Only these need placeholders, the resources that depend on a cycle are created once the placeholders exist.
+def get_cycle_members(names, dependencies):
+    def reaches(start, target):
+        visited = set()
+        stack = [dependency for dependency in dependencies[start] if dependency in names]
+        while stack:
+            name = stack.pop()
+            if name == target:
+                return True
+            if name not in visited:
+                visited.add(name)
+                stack += [dependency for dependency in dependencies[name] if dependency in names]
+        return False
+    return set(name for name in names if reaches(name, name))
+
+
+# Content that only ends the flow.  Used to create contact flows that are part of a cycle of references.
+def get_placeholder_content(resource):
+    if resource["Type"] == "AWS::Connect::ContactFlowModule":
+        action_type = "EndFlowModuleExecution"
+    elif resource["Properties"]["Type"] == "CONTACT_FLOW":
+        action_type = "DisconnectParticipant"
+    else:
+        action_type = "EndFlowExecution"
+    action_id = str(uuid.uuid4())
+    return json.dumps({
+        "Version": "2019-10-30",
+        "StartAction": action_id,
+        "Actions": [{"Identifier": action_id, "Type": action_type, "Parameters": {}, "Transitions": {}}]
+    })
+
+
+class Deployment:
+    def __init__(self, template, client, instance_id, max_workers):
+        self.resources = template["Resources"]
+        self.client = client
+        self.instance_id = instance_id
+        self.max_workers = max_workers
+        self.results = {}
+
+        # CloudFormation pseudo parameters and the template parameter are taken from the destination instance
+        instance_arn = client.describe_instance(InstanceId=instance_id)["Instance"]["Arn"]
+        self.variables = {
+            "AWS::Partition": instance_arn.split(":")[1],
+            "AWS::Region": instance_arn.split(":")[3],
+            "AWS::AccountId": instance_arn.split(":")[4],
+            "ConnectInstanceID": instance_id
+        }
+
+        # resources that already exist in the destination instance are matched by name
+        self.existing = {
+            "AWS::Connect::ContactFlow": self.list_existing('list_contact_flows', "ContactFlowSummaryList"),
+            "AWS::Connect::ContactFlowModule":
+                self.list_existing('list_contact_flow_modules', "ContactFlowModulesSummaryList"),
+            "AWS::Connect::HoursOfOperation": self.list_existing('list_hours_of_operations', "HoursOfOperationSummaryList")
+        }
+
+    def list_existing(self, list_api, summary_list):
+        existing = {}
+        paginator = self.client.get_paginator(list_api)
+        for page in paginator.paginate(InstanceId=self.instance_id,
+                                       PaginationConfig={
+                                                         "PageSize": 50,
+                                        }):
+            for summary in page[summary_list]:
+                existing[summary["Name"]] = summary
+        return existing
+
+    def list_associations(self, list_api, result_key, get_arn):
+        associations = set()
+        paginator = self.client.get_paginator(list_api)
+        parameters = {"LexVersion": "V2"} if list_api == "list_bots" else {}
+        for page in paginator.paginate(InstanceId=self.instance_id, **parameters):
+            associations.update(get_arn(item) for item in page[result_key])
+        return associations
+
+    # Makes the ARN of a deployed resource available to the contact flows that reference it,
+    # the same way Ref and Fn::GetAtt would
+    def set_arn(self, name, arn):
+        attribute = {
+            "AWS::Connect::ContactFlow": "ContactFlowArn",
+            "AWS::Connect::ContactFlowModule": "ContactFlowModuleArn",
+            "AWS::Connect::HoursOfOperation": "HoursOfOperationArn"
+        }[self.resources[name]["Type"]]
+        self.variables[name] = arn
+        self.variables[f"{name}.{attribute}"] = arn
+
+    # Runs the deployment of each resource concurrently.  A failure only affects the resources that reference it.
+    def run_wave(self, deploy, names):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {name: executor.submit(deploy, name) for name in names}
+        for name, future in futures.items():
+            try:
+                self.results[name] = future.result()
+            except Exception as e:
+                print(f"Error: {name} could not be deployed. {e}")
+                self.results[name] = "FAILED"
+
+    def deploy_hours_of_operation(self, name):
+        properties = self.resources[name]["Properties"]
+        existing = self.existing["AWS::Connect::HoursOfOperation"].get(properties["Name"])
+        if existing is None:
+            print(f"Creating hours of operation {properties['Name']}")
+            response = self.client.create_hours_of_operation(
+                InstanceId=self.instance_id,
+                Name=properties["Name"],
+                TimeZone=properties["TimeZone"],
+                Config=properties["Config"]
+            )
+            self.set_arn(name, response["HoursOfOperationArn"])
+            return "CREATED"
+
+        self.set_arn(name, existing["Arn"])
+        current = self.client.describe_hours_of_operation(
+            InstanceId=self.instance_id,
+            HoursOfOperationId=existing["Id"]
+        )["HoursOfOperation"]
+        sort_key = lambda config: json.dumps(config, sort_keys=True)
+        if current["TimeZone"] == properties["TimeZone"] and \
+                sorted(current["Config"], key=sort_key) == sorted(properties["Config"], key=sort_key):
+            return "UNCHANGED"
+
+        print(f"Updating hours of operation {properties['Name']}")
+        self.client.update_hours_of_operation(
+            InstanceId=self.instance_id,
+            HoursOfOperationId=existing["Id"],
+            Name=properties["Name"],
+            TimeZone=properties["TimeZone"],
+            Config=properties["Config"]
+        )
+        return "UPDATED"
+
+    # Replaces the Custom::ConnectAssociateLambda and Custom::ConnectAssociateLex resources
+    def deploy_association(self, name):
+        resource = self.resources[name]
+        if resource["Type"] == "Custom::ConnectAssociateLambda":
+            function_arn = render_sub(resource["Properties"]["FunctionArn"], self.variables)
+            if function_arn in self.lambda_functions:
+                return "UNCHANGED"
+            print(f"Associating {function_arn} with the Connect instance")
+            self.client.associate_lambda_function(InstanceId=self.instance_id, FunctionArn=function_arn)
+        else:
+            alias_arn = render_sub(resource["Properties"]["AliasArn"], self.variables)
+            if alias_arn in self.lex_bots:
+                return "UNCHANGED"
+            print(f"Associating {alias_arn} with the Connect instance")
+            self.client.associate_bot(InstanceId=self.instance_id, LexV2Bot={"AliasArn": alias_arn})
+        return "CREATED"
+
+    def create_placeholder(self, name):
+        resource = self.resources[name]
+        print(f"Creating placeholder for {resource['Properties']['Name']}")
+        self.create_contact_flow(name, get_placeholder_content(resource))
+        return "PLACEHOLDER"
+
+    def create_contact_flow(self, name, content):
+        resource = self.resources[name]
+        if resource["Type"] == "AWS::Connect::ContactFlowModule":
+            response = self.client.create_contact_flow_module(
+                InstanceId=self.instance_id,
+                Name=resource["Properties"]["Name"],
+                Content=content
+            )
+            self.set_arn(name, response["Arn"])
+            self.existing[resource["Type"]][resource["Properties"]["Name"]] = response
+        else:
+            response = self.client.create_contact_flow(
+                InstanceId=self.instance_id,
+                Name=resource["Properties"]["Name"],
+                Type=resource["Properties"]["Type"],
+                Content=content
+            )
+            self.set_arn(name, response["ContactFlowArn"])
+            self.existing[resource["Type"]][resource["Properties"]["Name"]] = \
+                {"Id": response["ContactFlowId"], "Arn": response["ContactFlowArn"]}
+
+    # Returns the content of a contact flow or module in the destination instance
+    def get_current_content(self, resource, existing):
+        try:
+            if resource["Type"] == "AWS::Connect::ContactFlowModule":
+                return self.client.describe_contact_flow_module(
+                    InstanceId=self.instance_id,
+                    ContactFlowModuleId=existing["Id"]
+                )["ContactFlowModule"]["Content"]
+            return self.client.describe_contact_flow(
+                InstanceId=self.instance_id,
+                ContactFlowId=existing["Id"]
+            )["ContactFlow"]["Content"]
+        except self.client.exceptions.ContactFlowNotPublishedException:
+            return None
+
+    def deploy_contact_flow(self, name):
+        resource = self.resources[name]
+        content = render_sub(resource["Properties"]["Content"], self.variables)
+        existing = self.existing[resource["Type"]].get(resource["Properties"]["Name"])
+        if existing is None:
+            print(f"Creating {resource['Properties']['Name']}")
+            self.create_contact_flow(name, content)
+            self.deploy_state(name, self.existing[resource["Type"]][resource["Properties"]["Name"]])
+            return "CREATED"
+
+        current_content = self.get_current_content(resource, existing)
+        changed = current_content is None or json.loads(current_content) != json.loads(content)
+        if changed:
+            print(f"Updating {resource['Properties']['Name']}")
+            if resource["Type"] == "AWS::Connect::ContactFlowModule":
+                self.client.update_contact_flow_module_content(
+                    InstanceId=self.instance_id,
+                    ContactFlowModuleId=existing["Id"],
+                    Content=content
+                )
+            else:
+                self.client.update_contact_flow_content(
+                    InstanceId=self.instance_id,
+                    ContactFlowId=existing["Id"],
+                    Content=content
+                )
+        changed = self.deploy_state(name, existing) or changed
+
+        if self.results.get(name) == "PLACEHOLDER":
+            return "CREATED"
+        return "UPDATED" if changed else "UNCHANGED"
+
+    # The state can not be set when a contact flow or module is created, so ARCHIVED is set afterwards.
+    # Returns True if the state was changed.
+    def deploy_state(self, name, existing):
+        resource = self.resources[name]
+        state = resource["Properties"].get("State", "ACTIVE").upper()
+        current_state = existing.get("ContactFlowState", existing.get("State", "ACTIVE")).upper()
+        if state == current_state:
+            return False
+
+        print(f"Setting the state of {resource['Properties']['Name']} to {state}")
+        if resource["Type"] == "AWS::Connect::ContactFlowModule":
+            self.client.update_contact_flow_module_metadata(
+                InstanceId=self.instance_id,
+                ContactFlowModuleId=existing["Id"],
+                State=state
+            )
+        else:
+            self.client.update_contact_flow_metadata(
+                InstanceId=self.instance_id,
+                ContactFlowId=existing["Id"],
+                ContactFlowState=state
+            )
+        existing["ContactFlowState" if resource["Type"] == "AWS::Connect::ContactFlow" else "State"] = state
+        return True
+
+    def deploy(self):
+        for name, resource in self.resources.items():
+            if resource["Type"] not in CONTACT_FLOW_TYPES + ["AWS::Connect::HoursOfOperation",
+                                                             "Custom::ConnectAssociateLambda",
+                                                             "Custom::ConnectAssociateLex"]:
+                print(f"Warning: {resource['Type']} resources can not be deployed without CloudFormation. " +
+                      f"{name} was skipped.")
+                self.results[name] = "SKIPPED"
+
+        # Lambdas and Lex bots must be associated with the instance before a contact flow can use them
+        self.lambda_functions = self.list_associations('list_lambda_functions', "LambdaFunctions", lambda arn: arn)
+        self.lex_bots = self.list_associations('list_bots', "LexBots", lambda bot: _.get(bot, "LexV2Bot.AliasArn"))
+        self.run_wave(self.deploy_association, [name for name, resource in self.resources.items()
+                                                if resource["Type"].startswith("Custom::ConnectAssociate")])
+        self.run_wave(self.deploy_hours_of_operation, [name for name, resource in self.resources.items()
+                                                       if resource["Type"] == "AWS::Connect::HoursOfOperation"])
+
+        # contact flows and modules that already exist can be referenced before they are updated
+        contact_flows = [name for name, resource in self.resources.items() if resource["Type"] in CONTACT_FLOW_TYPES]
+        for name in contact_flows:
+            existing = self.existing[self.resources[name]["Type"]].get(self.resources[name]["Properties"]["Name"])
+            if existing is not None:
+                self.set_arn(name, existing["Arn"])
+        dependencies = {name: get_dependencies(self.resources[name], contact_flows) for name in contact_flows}
+
+        # contact flows that use a Lambda function or Lex bot that could not be associated are not deployed
+        failed_associations = [get_association_arn(self.resources[name]) for name in self.results
+                               if self.resources[name]["Type"].startswith("Custom::ConnectAssociate")
+                               and self.results[name] == "FAILED"]
+        for name in contact_flows:
+            content = get_sub_string(self.resources[name]["Properties"]["Content"])
+            for arn in failed_associations:
+                if f'"{arn}"' in content:
+                    print(f"Error: {name} was not deployed because {arn} could not be associated with the instance.")
+                    self.results[name] = "FAILED"
+                    break
+
+        # Contact flows that reference each other are created with placeholder content first
+        new_contact_flows = set(name for name in contact_flows if name not in self.variables)
+        cycle_members = get_cycle_members(new_contact_flows, dependencies)
+        self.run_wave(self.create_placeholder, [name for name in contact_flows
+                                                if name in cycle_members and self.results.get(name) != "FAILED"])
+
+        remaining = list(contact_flows)
+        while remaining:
+            wave = [name for name in remaining
+                    if all(dependency in self.variables for dependency in dependencies[name])
+                    and self.results.get(name) != "FAILED"]
+            if not wave:
+                break
+            self.run_wave(self.deploy_contact_flow, wave)
+            remaining = [name for name in remaining if name not in wave]
+
+        for name in remaining:
+            if self.results.get(name) != "FAILED":
+                print(f"Error: {name} was not deployed because a resource it references could not be deployed.")
+                self.results[name] = "FAILED"
+        return self.results
+
+
+# Deploys the template to the Connect instance and returns the result for each resource:
+# CREATED, UPDATED, UNCHANGED, SKIPPED or FAILED
+def deploy_template(template, client, instance_id, max_workers=5):
+    results = Deployment(template, client, instance_id, max_workers).deploy()
+    for result in ["CREATED", "UPDATED", "UNCHANGED", "SKIPPED", "FAILED"]:
+        print(f"{result}: {len([name for name in results if results[name] == result])}")
+    return results
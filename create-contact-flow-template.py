@@ -7,13 +7,19 @@
 #
 #   Lex V2 references must be manually attached to the Connect instance
 
+import argparse
 import boto3
 import re
 import os
 import sys
 import json
-from functools import reduce
+import copy
+import hashlib
+from collections import OrderedDict
+from queue import Queue
+from threading import Thread
 import pydash as _
+from connect_deployer import deploy_template
 
 
 
@@ -31,206 +37,481 @@ def get_current_region():
 
 
 
-# Uses the Connect APIs to retrieve contact flows from the Connect instance
-# the format of the exported contact flows is not the same as what are exported from
-def export_contact_flow(name, resource_type):
-    print("Retrieving contact flows...")
-    paginator = client.get_paginator('list_contact_flows')
-    for page in paginator.paginate(InstanceId=config["Input"]["ConnectInstanceId"],
-                                   ContactFlowTypes=['CONTACT_FLOW',
-                                                     'CUSTOMER_QUEUE',
-                                                     'CUSTOMER_HOLD',
-                                                     'CUSTOMER_WHISPER',
-                                                     'AGENT_HOLD',
-                                                     'AGENT_WHISPER',
-                                                     'OUTBOUND_WHISPER',
-                                                     'AGENT_TRANSFER',
-                                                     'QUEUE_TRANSFER'],
-                                   PaginationConfig={
-                                                     "MaxItems": 50,
-                                                     "PageSize": 50,
-                                    }):
+# Raised when a resource can not be added to the template
+class ResourceNotExportable(Exception):
+    pass
 
-        # we only want to retrieve contact flows specified in the config file
-        for contact_flow in page["ContactFlowSummaryList"]:
-            if(name not in contact_flow["Name"]):
-                continue
-            try:
-                print(f"Calling describe_contact flow for {contact_flow['Name']}")
-                properties = client.describe_contact_flow(
-                    InstanceId=config["Input"]["ConnectInstanceId"],
-                    ContactFlowId=contact_flow["Id"]
-                )["ContactFlow"]
-            except client.exceptions.ContactFlowNotPublishedException:
-                print(f"Warning: {contact_flow['Name']} is not published, Unable to export.")
-                continue
-            properties["InstanceArn"] = {"Fn::Sub": connect_arn}
-
-            # Make sure the CloudFormation logical resource name is valud
-            resource_name = re.sub(r'[\W_]+', '', contact_flow["Name"])
-            contact_flows[contact_flow["Id"]] = resource_name
-            template["Resources"].update(
-                {resource_name: {
-                    "Type": resource_type,
-                    "Properties": {
-                    }
-                }})
-            print(f"Creating resource {resource_name}")
-            # Some properties  that are returned by the API call should not be included in the output template
-            excluded_properties = ["Id", "Arn", "ResponseMetadata", "InstanceId", "Tags", "Description", "Status"]
-            keys_to_add = list(properties.keys() - set(excluded_properties))
-            properties_to_add = list(map(lambda x: {x: properties[x]}, keys_to_add))
-
-            # add the contact flow to the the CF template
-            template["Resources"][resource_name]["Properties"].update(reduce(lambda a, b: dict(a, **b), properties_to_add))
-            content = template["Resources"][resource_name]["Properties"]["Content"]
-
-            print("Processing contact flow content")
-            # Replace the hard coded partition, region, account number and Connect Instance ID with parameters
-            content = replace_pseudo_parms(content)
-
-            # Associate any Lambdas found to the Connect instance
-            attach_lambdas(content)
-
-            # some resource types are created by default when you create a Connect instance
-            # the identifiers will be different between accounts.  Map the source identifiers to the destination
-            content = replace_with_mappings(content)
-
-            # Add the resource to the template
-            print("Adding the resource {resource_name} to the template")
-            template["Resources"][resource_name]["Properties"]["Content"] = {"Fn::Sub": content}
-
-
-# Uses the Connect APIs to retrieve contact flow modules from the Connect instance
-# the format of the exported contact flows is not the same as what are exported from Connect
-def export_contact_flow_modules(name, resource_type):
-    paginator = client.get_paginator('list_contact_flow_modules')
-    print("Retrieving contact flow modules...")
-    for page in paginator.paginate(InstanceId=config["Input"]["ConnectInstanceId"],
-                                   ContactFlowModuleState="active",
-                                   PaginationConfig={
-                                                     "MaxItems": 50,
-                                                     "PageSize": 50,
-                                    }):
-
-        for contact_flow_module in page["ContactFlowModulesSummaryList"]:
-            if(name not in contact_flow_module["Name"]):
-                continue
 
-            print(f"Calling describe_contact_flow_module for {contact_flow_module['Name']}")
-            properties = client.describe_contact_flow_module(
-                InstanceId=config["Input"]["ConnectInstanceId"],
-                ContactFlowModuleId=contact_flow_module["Id"].split("/")[-1]
-            )
+# Calls the describe API of a resource type and returns the properties of the resource
+def describe_resource(spec, resource_id):
+    response = getattr(client, spec["DescribeApi"])(**{
+        "InstanceId": config["Input"]["ConnectInstanceId"],
+        spec["IdParameter"]: resource_id.split("/")[-1]
+    })
+    return response[spec["DescribeResult"]]
 
-            properties = properties["ContactFlowModule"]
-            properties["InstanceArn"] = {"Fn::Sub": connect_arn}
 
-            # CF ResourceNames should only contain letters and a '-'
-            resource_name = re.sub(r'[\W_]+', '', contact_flow_module["Name"])+"Module"
-            contact_flow_modules[contact_flow_module["Id"]] = resource_name
-            print(f"Creating resource {resource_name}")
-
-            template["Resources"].update(
-                {resource_name: {
-                    "Type": resource_type,
-                    "Properties": {
-                    }
-                }})
+# CF ResourceNames should only contain letters and numbers
+def get_resource_name(spec, summary):
+    return re.sub(r'[\W_]+', '', summary["Name"]) + spec["ResourceNameSuffix"]
 
-            # Map API response to CF properties and exclude properties that are not supported.
-            excluded_properties = ["Id", "Arn", "ResponseMetadata", "InstanceId", "Status", "Tags", "Description"]
-            keys_to_add = list(properties.keys() - set(excluded_properties))
-            properties_to_add = list(map(lambda x: {x: properties[x]}, keys_to_add))
 
-            template["Resources"][resource_name]["Properties"].update(reduce(lambda a, b: dict(a, **b), properties_to_add))
+# The export runs as a pipeline of stages connected by bounded queues, so resources are transformed while
+# later describe calls are still in flight:
+#
+#   list_stage -> describe_stage (max_concurrency threads) -> transform_stage -> export_resources
+#
+# Every item carries the position it was listed in, so the resources are added to the template in a
+# stable order.  None marks the end of a stage.  An exception is passed down the pipeline with its item and
+# raised by export_resources().  Resources that are already in the journal skip straight to the last stage.
+#
+# The list stage also records the name of every resource it lists, including the resource types that are only
+# referenced, so references to resources that were not exported are looked up in the manifest file without
+# describing them.
+def list_stage(specs, names, describe_queue, emit_queue):
+    index = 0
+    try:
+        for spec in specs:
+            for summary in list_summaries(spec):
+                if not any(name in summary["Name"] for name in names):
+                    continue
+                if (spec["ResourceType"], summary["Id"]) in journal_entries:
+                    emit_queue.put((index, spec, summary, journal_entries[(spec["ResourceType"], summary["Id"])]))
+                else:
+                    describe_queue.put((index, spec, summary, None))
+                index += 1
+
+        referenced_types = set(_.flatten([spec["ReferencedTypes"] for spec in specs]))
+        for resource_type in referenced_types:
+            if resource_specs[resource_type] not in specs:
+                for _summary in list_summaries(resource_specs[resource_type]):
+                    pass
+    except Exception as e:
+        describe_queue.put((index, None, None, e))
+
+    for _worker in range(max_concurrency):
+        describe_queue.put(None)
+
+
+def list_summaries(spec):
+    print(f"Retrieving {spec['SummaryList']}...")
+    paginator = client.get_paginator(spec["ListApi"])
+    for page in paginator.paginate(InstanceId=config["Input"]["ConnectInstanceId"],
+                                   **spec["ListParameters"],
+                                   PaginationConfig={
+                                                     "PageSize": 50,
+                                    }):
+        for summary in page[spec["SummaryList"]]:
+            spec["SourceNames"][summary["Id"]] = summary["Name"]
+            yield summary
 
-            content = template["Resources"][resource_name]["Properties"]["Content"]
-            print("Processing contact flow content")
-            # Replace the hard coded partition, region, account number and Connect Instance ID with parameters
-            content = replace_pseudo_parms(content)
 
-            # Attach any Lambdas found to the Connect instance
-            attach_lambdas(content)
+def describe_stage(describe_queue, transform_queue):
+    while (item := describe_queue.get()) is not None:
+        index, spec, summary, result = item
+        if not isinstance(result, Exception):
+            try:
+                print(f"Calling {spec['DescribeApi']} for {summary['Name']}")
+                properties = describe_resource(spec, summary["Id"])
+                # some resource types need more than one API call
+                if spec["Describe"] is not None:
+                    spec["Describe"](properties)
+                result = properties
+            except client.exceptions.ContactFlowNotPublishedException:
+                print(f"Warning: {summary['Name']} is not published, Unable to export.")
+                result = None
+            except Exception as e:
+                result = e
+        transform_queue.put((index, spec, summary, result))
+    transform_queue.put(None)
+
+
+def transform_stage(transform_queue, emit_queue):
+    finished_workers = 0
+    while finished_workers < max_concurrency:
+        item = transform_queue.get()
+        if item is None:
+            finished_workers += 1
+            continue
+        index, spec, summary, result = item
+        if isinstance(result, dict):
+            try:
+                result = transform_resource(spec, summary, result)
+            except Exception as e:
+                result = e
+        emit_queue.put((index, spec, summary, result))
+    emit_queue.put(None)
+
+
+# Converts the properties returned by the describe API to the CloudFormation resource.
+# Returns the resources to add to the template, or None if the resource can not be exported.
+def transform_resource(spec, summary, properties):
+    properties["InstanceArn"] = {"Fn::Sub": connect_arn}
+    resource_name = get_resource_name(spec, summary)
+    print(f"Creating resource {resource_name}")
+
+    # Map identifiers to the destination instance and process the contact flow content
+    additional_resources = {}
+    try:
+        if spec["Transform"] is not None:
+            additional_resources = spec["Transform"](properties) or {}
+    except ResourceNotExportable as e:
+        print(f"Warning: {summary['Name']} can not be exported. {e}")
+        return None
+
+    # Some properties that are returned by the API call should not be included in the output template
+    excluded_properties = set(spec["ExcludedProperties"])
+    resources = {
+        resource_name: {
+            "Type": spec["ResourceType"],
+            "Properties": {key: value for key, value in properties.items() if key not in excluded_properties}
+        }
+    }
+    resources.update(additional_resources)
+    return resources
+
+
+# Uses the Connect APIs to retrieve every resource whose name contains one of the names in the config file
+# and adds it to the template.  This is the last stage of the pipeline.
+def export_resources(specs, names):
+    describe_queue = Queue(maxsize=max_concurrency * 2)
+    transform_queue = Queue(maxsize=max_concurrency * 2)
+    emit_queue = Queue(maxsize=max_concurrency * 2)
+
+    stages = [Thread(target=list_stage, args=(specs, names, describe_queue, emit_queue), daemon=True),
+              Thread(target=transform_stage, args=(transform_queue, emit_queue), daemon=True)]
+    stages += [Thread(target=describe_stage, args=(describe_queue, transform_queue), daemon=True)
+               for _worker in range(max_concurrency)]
+    for stage in stages:
+        stage.start()
+
+    # the describe calls finish out of order
+    pending = {}
+    next_index = 0
+    while (item := emit_queue.get()) is not None:
+        pending[item[0]] = item
+        while next_index in pending:
+            index, spec, summary, resources = pending.pop(next_index)
+            next_index += 1
+            if isinstance(resources, Exception):
+                raise resources
+            if (spec["ResourceType"], summary["Id"]) not in journal_entries:
+                write_journal_entry(spec, summary, resources)
+            if resources is None:
+                continue
+            spec["ResourceNames"][summary["Id"]] = get_resource_name(spec, summary)
+            print(f"Adding the resource {get_resource_name(spec, summary)} to the template")
+            template["Resources"].update(resources)
 
-            # some resource types are created by default when you create a Connect instance
-            # the identifiers will be different between accounts.  Map the source identifiers to the destination
-            content = replace_with_mappings(content)
-            template["Resources"][resource_name]["Properties"]["Content"] = {"Fn::Sub": content}
+    # the list stage failed
+    for index, spec, summary, resources in pending.values():
+        if isinstance(resources, Exception):
+            raise resources
 
-            # Map the phone number from the destination Connect instance to the source connect instance
-            for source_phone, target_phone in phone_number_mappings.items():
-                content = content.replace(source_phone, target_phone)
-            template["Resources"][resource_name]["Properties"]["Content"] = {"Fn::Sub": content}
 
-            # The API returns the state as lowercase.  CF requires it to be uppercase.
-            state = template["Resources"][resource_name]["Properties"]["State"].upper()
-            print("Adding the resource {resource_name} to the template")
+# The journal records every resource as soon as it has been transformed, so an export that fails can be
+# continued with --resume instead of starting over.  The first line identifies the configuration the
+# journal was created with, each following line is one resource.
+#
+# The journaled resources have already been transformed with the manifest file, the phone number mappings and
+# the source account, partition and region.  A journal created with different inputs can not be resumed,
+# for example after the manifest file was fixed because the references could not be validated.
+def get_journal_header():
+    return {
+        "ConnectInstanceId": config["Input"]["ConnectInstanceId"],
+        "ResourceFilters": config["ResourceFilters"],
+        "TransformInputs": hashlib.sha256(json.dumps([
+            account_number,
+            partition,
+            region,
+            phone_number_mappings,
+            output_arns
+        ], sort_keys=True, default=str).encode()).hexdigest()
+    }
 
-            template["Resources"][resource_name]["Properties"]["State"] = state
 
+# Returns the journaled resources keyed by resource type and identifier and opens the journal for writing.
+# An incomplete last line is left by a run that stopped while writing it and is discarded.
+def open_journal(journal_file_name, resume):
+    global journal
+    if not resume and os.path.exists(journal_file_name):
+        raise Exception(f"{journal_file_name} contains an export that did not finish. Run the script with --resume " +
+                        "to continue it, or delete the file to start a new export.")
 
-# Uses the Connect APIs to retrieve hours of operations from the Connect instance
-# the format of the exported contact flows is not the same as what are exported from
-def export_hours_of_operation(name, resource_type):
-    print("Processing hours of operation")
-    paginator = client.get_paginator('list_hours_of_operations')
+    entries = {}
+    if resume and os.path.exists(journal_file_name):
+        valid_length = 0
+        with open(journal_file_name, "r") as file:
+            header = file.readline()
+            try:
+                header_matches = json.loads(header) == get_journal_header()
+            except json.JSONDecodeError:
+                # the run stopped while the header was written
+                header_matches = False
+            if header_matches:
+                valid_length += len(header.encode())
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    entries[(entry["ResourceType"], entry["Id"])] = entry["Resources"]
+                    valid_length += len(line.encode())
+
+        if header_matches:
+            print(f"Resuming the export with {len(entries)} resources from {journal_file_name}")
+            os.truncate(journal_file_name, valid_length)
+            journal = open(journal_file_name, "a")
+            return entries
+        print(f"Warning: {journal_file_name} was created with a different configuration or manifest file, " +
+              "or is incomplete, and can not be resumed. Starting a new export.")
+    elif resume:
+        print(f"Warning: {journal_file_name} was not found, starting a new export.")
+
+    journal = open(journal_file_name, "w")
+    journal.write(json.dumps(get_journal_header()) + "\n")
+    journal.flush()
+    return entries
+
+
+# Resources that were skipped are recorded as well, so they are not described again
+def write_journal_entry(spec, summary, resources):
+    journal.write(json.dumps({
+        "ResourceType": spec["ResourceType"],
+        "Id": summary["Id"],
+        "Name": summary["Name"],
+        "Resources": resources
+    }, default=str) + "\n")
+    journal.flush()
+
+
+# Placeholder for the ARN of a resource in the destination instance.  Resources are transformed before the
+# resources they reference have been exported, so the ARNs are resolved by resolve_deferred_arns() once
+# the export has finished.
+def deferred_arn(resource_type, resource_id, required=True):
+    return {"DeferredArn": {"ResourceType": resource_type, "Id": resource_id.split("/")[-1], "Required": required}}
+
+
+# Returns the ARN of a resource in the destination instance referenced by a source identifier.
+# Resources exported to the template are referenced with Fn::GetAtt, otherwise the resource is looked up
+# in the manifest file by the name recorded by list_stage().  Returns None if the resource can not be found.
+def get_dest_arn(resource_type, resource_id):
+    spec = resource_specs[resource_type]
+    resource_id = resource_id.split("/")[-1]
+    if resource_id in spec["ResourceNames"]:
+        return {"Fn::GetAtt": [spec["ResourceNames"][resource_id], spec["ArnAttribute"]]}
+
+    source_name = spec["SourceNames"].get(resource_id)
+    if source_name is None:
+        return None
+    dest_resource = _.get(output_arns, [spec["SummaryList"], source_name])
+    return dest_resource["Arn"] if isinstance(dest_resource, dict) else dest_resource
+
+
+def resolve_deferred_arn(value):
+    if isinstance(value, list):
+        return [resolve_deferred_arn(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "DeferredArn" not in value:
+        resolved = {key: resolve_deferred_arn(item) for key, item in value.items()}
+        # optional references that could not be found are left out
+        return {key: item for key, item in resolved.items() if item is not None or value[key] is None}
+
+    reference = value["DeferredArn"]
+    arn = get_dest_arn(reference["ResourceType"], reference["Id"])
+    if arn is None and reference["Required"]:
+        raise ResourceNotExportable(
+            f"The {reference['ResourceType']} {reference['Id']} was not exported and not found in the manifest file.")
+    if arn is None:
+        print(f"Warning: The {reference['ResourceType']} {reference['Id']} was not exported " +
+              "and not found in the manifest file. The reference will not be set.")
+    return arn
+
+
+# Replaces the placeholders created by deferred_arn().  A resource with a required reference that can not be
+# found is removed from the template, and resources exported after it reference the manifest file instead.
+def resolve_deferred_arns():
+    for resource in list(template["Resources"]):
+        try:
+            template["Resources"][resource]["Properties"] = \
+                resolve_deferred_arn(template["Resources"][resource]["Properties"])
+        except ResourceNotExportable as e:
+            print(f"Warning: {resource} can not be exported. {e}")
+            del template["Resources"][resource]
+            for spec in resource_specs.values():
+                for resource_id, resource_name in list(spec["ResourceNames"].items()):
+                    if resource_name == resource:
+                        del spec["ResourceNames"][resource_id]
+
+
+# Caches the transformed contact flow content and the resources it references, keyed by a hash of the
+# content and everything the transform depends on.  The least recently used entries are evicted, and the cache
+# can be saved to a file so it is shared between runs.
+class TransformCache:
+    def __init__(self, file_name=None, max_entries=1000):
+        self.file_name = file_name
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if file_name is not None and os.path.exists(file_name):
+            with open(file_name, "r") as file:
+                self.entries.update(json.load(file))
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return copy.deepcopy(self.entries[key])
+
+    def put(self, key, value):
+        self.entries[key] = copy.deepcopy(value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        print(f"Transform cache: {self.hits} hits, {self.misses} misses")
+        if self.file_name is None:
+            return
+        with open(self.file_name + ".tmp", "w") as file:
+            json.dump(self.entries, file, default=str)
+        os.replace(self.file_name + ".tmp", self.file_name)
+
+
+# The key is calculated after the partition, region, account number and Connect Instance ID have been replaced
+# with parameters.  References to prompts, queues, contact flows and other resources still contain the source
+# identifiers, so copies of a contact flow in other instances only share an entry if they do not reference any
+# other resources.  Exporting the same contact flows again, or resuming an export, reuses the entries.
+# The rest of the transform depends on the phone number mappings and the prompts in the manifest file.
+# The hash of those is calculated once.
+def get_transform_cache_key(content):
+    global transform_inputs_hash
+    if transform_inputs_hash is None:
+        transform_inputs_hash = hashlib.sha256(json.dumps([
+            phone_number_mappings,
+            output_arns.get("PromptSummaryList")
+        ], sort_keys=True).encode()).hexdigest()
+    return hashlib.sha256((transform_inputs_hash + content).encode()).hexdigest()
+
+
+def transform_contact_flow(properties):
+    # Replace the hard coded partition, region, account number and Connect Instance ID with parameters
+    content = replace_pseudo_parms(properties["Content"])
+
+    cache_key = get_transform_cache_key(content)
+    cached = transform_cache.get(cache_key)
+    if cached is not None:
+        print("Using the cached contact flow content")
+        properties["Content"] = {"Fn::Sub": cached["Content"]}
+        return cached["Resources"]
+
+    print("Processing contact flow content")
+    # Associate any Lambdas found to the Connect instance
+    resources = attach_lambdas(content)
+
+    # some resource types are created by default when you create a Connect instance
+    # the identifiers will be different between accounts.  Map the source identifiers to the destination
+    content = replace_with_mappings(content)
+    transform_cache.put(cache_key, {"Content": content, "Resources": resources})
+    properties["Content"] = {"Fn::Sub": content}
+    return resources
+
+
+def transform_contact_flow_module(properties):
+    resources = transform_contact_flow(properties)
+
+    # The API returns the state as lowercase.  CF requires it to be uppercase.
+    properties["State"] = properties["State"].upper()
+    return resources
+
+
+# The queue only returns the identifier of its outbound caller ID number
+def describe_queue_phone_number(properties):
+    phone_number_id = _.get(properties, "OutboundCallerConfig.OutboundCallerIdNumberId")
+    if phone_number_id is not None:
+        properties["OutboundCallerConfig"]["OutboundCallerIdNumber"] = client.describe_phone_number(
+            PhoneNumberId=phone_number_id
+        )["ClaimedPhoneNumberSummary"]["PhoneNumber"]
+
+
+# CloudFormation references the hours of operation and the outbound caller configuration by ARN
+def transform_queue(properties):
+    properties["HoursOfOperationArn"] = deferred_arn("HoursOfOperation", properties["HoursOfOperationId"])
+
+    outbound_caller_config = properties.pop("OutboundCallerConfig", {})
+    properties["OutboundCallerConfig"] = _.pick(outbound_caller_config, "OutboundCallerIdName")
+    if "OutboundFlowId" in outbound_caller_config:
+        properties["OutboundCallerConfig"]["OutboundFlowArn"] = \
+            deferred_arn("ContactFlow", outbound_caller_config["OutboundFlowId"], required=False)
+    if "OutboundCallerIdNumber" in outbound_caller_config:
+        phone_number = outbound_caller_config["OutboundCallerIdNumber"]
+        phone_number = phone_number_mappings.get(phone_number, phone_number)
+        phone_number_arn = _.get(output_arns, ["PhoneNumberSummaryList", phone_number, "Arn"])
+        if phone_number_arn is None:
+            print(f"Warning: the outbound caller ID number of {properties['Name']} was not found and will not be set.")
+        else:
+            properties["OutboundCallerConfig"]["OutboundCallerIdNumberArn"] = phone_number_arn
+    if not properties["OutboundCallerConfig"]:
+        del properties["OutboundCallerConfig"]
+
+
+# The routing profile queues are not returned by describe_routing_profile
+def describe_routing_profile_queues(properties):
+    properties["QueueConfigs"] = []
+    paginator = client.get_paginator('list_routing_profile_queues')
     for page in paginator.paginate(InstanceId=config["Input"]["ConnectInstanceId"],
+                                   RoutingProfileId=properties["RoutingProfileId"],
                                    PaginationConfig={
-                                                     "MaxItems": 50,
                                                      "PageSize": 50,
                                     }):
+        properties["QueueConfigs"] += page["RoutingProfileQueueConfigSummaryList"]
 
-        for hours_of_operation in page["HoursOfOperationSummaryList"]:
-            if(name not in hours_of_operation["Name"]):
-                continue
 
-            print(f"Calling describe_contact_flow_module for {hours_of_operation['Name']}")
-            properties = client.describe_hours_of_operation(
-                InstanceId=config["Input"]["ConnectInstanceId"],
-                HoursOfOperationId=hours_of_operation["Id"].split("/")[-1]
-            )["HoursOfOperation"]
+def transform_routing_profile(properties):
+    properties["DefaultOutboundQueueArn"] = deferred_arn("Queue", properties["DefaultOutboundQueueId"])
+    properties["QueueConfigs"] = [{
+        "Delay": queue_config["Delay"],
+        "Priority": queue_config["Priority"],
+        "QueueReference": {
+            "Channel": queue_config["Channel"],
+            "QueueArn": deferred_arn("Queue", queue_config["QueueId"])
+        }
+    } for queue_config in properties["QueueConfigs"]]
 
-            properties["InstanceArn"] = {"Fn::Sub": connect_arn}
 
-            # CF ResourceNames should only contain letters and a '-'
-            resource_name = re.sub(r'[\W_]+', '', hours_of_operation["Name"])+"HoursOfOperation"
-            hours_of_operations[hours_of_operation["Id"]] = resource_name
-            template["Resources"].update(
-                {resource_name: {
-                    "Type": resource_type,
-                    "Properties": {
-                    }
-                }})
-            print(f"Creating resource {resource_name}")
-            # Map API response to CF properties and exclude properties that are not supported.
-            excluded_properties = [
-                "Id",
-                "Arn",
-                "ResponseMetadata",
-                "InstanceId",
-                "HoursOfOperationId",
-                "HoursOfOperationArn",
-                "Tags",
-                "Description"
-            ]
-            keys_to_add = list(properties.keys() - set(excluded_properties))
-
-            properties_to_add = list(map(lambda x: {x: properties[x]}, keys_to_add))
-            template["Resources"][resource_name]["Properties"].update(reduce(lambda a, b: dict(a, **b), properties_to_add))
+# Quick connects reference queues and contact flows by identifier, CloudFormation requires ARNs
+def transform_quick_connect(properties):
+    quick_connect_config = properties["QuickConnectConfig"]
+    if "UserConfig" in quick_connect_config:
+        raise ResourceNotExportable("Users are not migrated.")
+
+    if "QueueConfig" in quick_connect_config:
+        quick_connect_config["QueueConfig"] = {
+            "QueueArn": deferred_arn("Queue", quick_connect_config["QueueConfig"]["QueueId"]),
+            "ContactFlowArn": deferred_arn("ContactFlow", quick_connect_config["QueueConfig"]["ContactFlowId"])
+        }
 
 
+# Returns the resources that associate any Lambdas found to the Connect instance
 def attach_lambdas(content):
     content = json.loads(content)
     lambda_attachments = list(filter(lambda t: t["Type"] == "InvokeLambdaFunction", content["Actions"]))
 
+    resources = {}
     for attachment in lambda_attachments:
         lambda_arn = _.get(attachment, "Parameters.LambdaFunctionARN")
+        # invalid ARNs are reported by validate_references()
+        if lambda_arn is None or is_dynamic_reference(lambda_arn):
+            continue
         lambda_name = lambda_arn.split(":")[-1]
         resource_name = re.sub(r'[\W_]+', '', lambda_name)+"LambdaPermission"
 
         print(f"Creating an AttachLambda resource for {lambda_name}")
-        template["Resources"].update(
+        resources.update(
             {
                 resource_name: {
                     "Type": "Custom::ConnectAssociateLambda",
@@ -241,26 +522,7 @@ def attach_lambdas(content):
                     }
                 }
             })
-
-
-def get_lexbot_details(lex_id):
-    lex_client = boto3.client('lexv2-models',region_name=get_current_region())
-    lex_bot_details = lex_client.describe_bot(botId=lex_id.split("/")[1])
-    lex_alias_details = lex_client.describe_bot_alias(botAliasId=lex_id.split("/")[2], botId=lex_id.split("/")[1])
-
-    dest_bot = _.get(output_arns, ["LexBotSummaries", lex_bot_details["botName"]])
-    dstBotAliasId = list(filter(lambda alias: alias["botAliasName"] == lex_alias_details["botAliasName"],
-                         dest_bot["botAliases"]))[0]
-
-    return {
-        "alias": lex_alias_details["botAliasName"],
-        "name": lex_bot_details["botName"],
-        "botId": lex_bot_details["botId"],
-        "botAliasId": lex_alias_details["botAliasId"],
-        "botAliasName": lex_alias_details["botAliasName"],
-        "dstBotId": dest_bot["botId"],
-        "dtsBotAliasId": dstBotAliasId
-    }
+    return resources
 
 
 def create_lexV2_attachment_resource(content, lex_details):
@@ -283,49 +545,6 @@ def create_lexV2_attachment_resource(content, lex_details):
             }
 
 
-# Uses the Connect APIs to retrieve quick connects from the Connect instance
-# the format of the exported contact flows is not the same as what are exported from
-def export_quick_connects(name, resource_type):
-    paginator = client.get_paginator('list_quick_connects')
-    for page in paginator.paginate(InstanceId=config["Input"]["ConnectInstanceId"],
-                                   QuickConnectTypes=["USER", "QUEUE", "PHONE_NUMBER"],
-                                   PaginationConfig={
-                                                     "MaxItems": 50,
-                                                     "PageSize": 50,
-                                    }):
-
-        for quick_connect in page["QuickConnectSummaryList"]:
-            if(name not in quick_connect["Name"]):
-                continue
-
-            properties = client.describe_quick_connect(
-                InstanceId=config["Input"]["ConnectInstanceId"],
-                QuickConnectId=quick_connect["Id"].split("/")[-1]
-            )["QuickConnect"]
-
-            properties["InstanceArn"] = {"Fn::Sub": connect_arn}
-            resource_name = re.sub(r'[\W_]+', '', quick_connect["Name"])+"QuickConnect"
-            quick_connects[quick_connect["Id"]] = resource_name
-            template["Resources"].update(
-                {resource_name: {
-                    "Type": resource_type,
-                    "Properties": {
-                    }
-                }})
-            excluded_properties = ["Id",
-                                   "Arn",
-                                   "ResponseMetadata",
-                                   "InstanceId",
-                                   "QuickConnectId",
-                                   "QuickConnectARN",
-                                   "Tags",
-                                   "Description"]
-            keys_to_add = list(properties.keys() - set(excluded_properties))
-
-            properties_to_add = list(map(lambda x: {x: properties[x]}, keys_to_add))
-            template["Resources"][resource_name]["Properties"].update(reduce(lambda a, b: dict(a, **b), properties_to_add))
-
-
 # By the time this method is called, the original arn that is contained in the exported contact flow
 # has been converted from this:
 #
@@ -352,6 +571,8 @@ def replace_contact_flowids():
         transfers = list(filter(lambda t: t["Type"] == "TransferToFlow", content["Actions"]))
         for transfer in transfers:
             contact_flow_arn = transfer["Parameters"]["ContactFlowId"]
+            if is_dynamic_reference(contact_flow_arn):
+                continue
             contact_flow_id = transfer["Parameters"]["ContactFlowId"].split("/")[-1]
 
             new_arn = contact_flow_arn.replace(contact_flow_id, "${" + contact_flows[contact_flow_id] + ".ContactFlowArn}")
@@ -364,7 +585,7 @@ def replace_contact_flowids():
         modules = list(filter(lambda t: t["Type"] == "UpdateContactEventHooks", content["Actions"]))
         for module in modules:
             customer_queue = _.get(module,"Parameters.EventHooks.CustomerQueue")
-            if(customer_queue is None):
+            if(customer_queue is None or is_dynamic_reference(customer_queue)):
                 continue
             contact_flow_id = customer_queue.split("/")[-1]
             contact_flow_arn = customer_queue
@@ -377,18 +598,20 @@ def replace_contact_flowids():
                 template["Resources"][resource]["Properties"]["Content"]["Fn::Sub"].replace(contact_flow_arn, new_arn)
 
 
+# Returns the name of a module in the source instance that was recorded by list_stage()
+def get_source_module_name(contact_flow_id):
+    return resource_specs["ContactFlowModule"]["SourceNames"].get(contact_flow_id.split("/")[-1])
+
+
 # Returns the contact flow identifier in the destination instance based on the manifest file
 # by the identifier referenced in the source contact flow
 #
 # This allows contact flows to reference pre-existing contact flows in the destination Connect instance
 # that are not being exported
-def get_dest_contact_flow_module(contact_flow_id):
-    # first look in the current Connect instance
-    contact_flow = client.describe_contact_flow_module(
-                InstanceId=config["Input"]["ConnectInstanceId"],
-                ContactFlowModuleId=contact_flow_id
-            )
-    contact_flow_name = contact_flow["ContactFlowModule"]["Name"]
+def get_dest_contact_flow_module(contact_flow_id, contact_flow_name):
+    # the name is in the action metadata, or was recorded when the modules were listed
+    if contact_flow_name is None:
+        contact_flow_name = get_source_module_name(contact_flow_id)
     id = _.get(output_arns, ["ContactFlowModulesSummaryList", contact_flow_name, "Id"])
     return {
         "name": contact_flow_name,
@@ -404,11 +627,15 @@ def replace_contact_module_flowids():
         content = json.loads(template["Resources"][resource]["Properties"]["Content"]["Fn::Sub"])
         content_string = template["Resources"][resource]["Properties"]["Content"]["Fn::Sub"]
         modules = list(filter(lambda t: t["Type"] == "InvokeFlowModule", content["Actions"]))
+        metadata = _.get(content, "Metadata.ActionMetadata", {})
         cf_vars = {}
         for module in modules:
             contact_flow_id = module["Parameters"]["FlowModuleId"]
-            dest_module = get_dest_contact_flow_module(contact_flow_id)
+            if is_dynamic_reference(contact_flow_id):
+                continue
             if(contact_flow_id not in contact_flow_modules):
+                dest_module = get_dest_contact_flow_module(
+                    contact_flow_id, _.get(metadata, [module["Identifier"], "contactFlowModuleName"]))
                 if(dest_module["id"] is None):
                     raise Exception(
                         f"The referenced module ${dest_module['name']} " +
@@ -444,10 +671,17 @@ def replace_lexbot_ids():
         content = json.loads(contact_flow)
         lex_actions = list(filter(lambda t: t["Type"] == "ConnectParticipantWithLexBot", content["Actions"]))
         cf_vars = template["Resources"][resource]["Properties"]["Content"]["Fn::Sub"][1]
+        metadata = _.get(content, "Metadata.ActionMetadata", {})
         for lex_action in lex_actions:
+            action_metadata = metadata.get(lex_action["Identifier"], {})
             alias_arn = _.get(lex_action, "Parameters.LexV2Bot.AliasArn")
-            lex_id = alias_arn.split(":")[-1]
-            lex_details = get_lexbot_details(lex_id)
+            if action_metadata.get("useDynamicLexBotArn") or is_dynamic_reference(alias_arn):
+                continue
+            # validate_references() checked the bot and alias names in the metadata against the manifest file
+            lex_details = {
+                "name": action_metadata["lexV2BotName"],
+                "botAliasName": action_metadata["lexV2BotAliasName"]
+            }
             dest_arn = get_dest_lex_bot(alias_arn, lex_details)
 
 #            print(f"Replaced a contact flow module reference with {new_arn} in a InvokeFlowModule action")
@@ -476,6 +710,8 @@ def replace_hours_of_operation():
                 continue
 
             hours_arn = hours["Parameters"]["Hours"]
+            if is_dynamic_reference(hours_arn):
+                continue
             hours_id = hours_arn.split("/")[-1]
             new_arn =\
                 "arn:${AWS::Partition}:connect:${AWS::Region}:" +\
@@ -487,8 +723,36 @@ def replace_hours_of_operation():
                 template["Resources"][resource]["Properties"]["Content"]["Fn::Sub"][0].replace(hours_arn, new_arn)
 
 
-# There are default audio prompts and queues that come with a Connect instance
-# map the identifiers to the destination Connect instance
+# This is the same concept as replace_contact_flowids() for queues.  Queues that were exported are
+# referenced with Fn::GetAtt, the others are mapped to the destination instance with the manifest file.
+def replace_queue_ids():
+    for resource in template["Resources"]:
+        if "Content" not in template["Resources"][resource]["Properties"]:
+            continue
+        content = json.loads(template["Resources"][resource]["Properties"]["Content"]["Fn::Sub"][0])
+        metadata = _.get(content, "Metadata.ActionMetadata", {})
+        for action_metadata in metadata.values():
+            queue = action_metadata.get("queue")
+            if not isinstance(queue, dict) or queue.get("id") is None or is_dynamic_reference(queue["id"]):
+                continue
+            queue_arn = queue["id"]
+            queue_id = queue_arn.split("/")[-1]
+            if queue_id in queues:
+                # the action parameters and the metadata both contain the queue ARN
+                source = queue_arn
+                new_arn = "${" + queues[queue_id] + ".QueueArn}"
+            else:
+                source = queue_id
+                new_arn = _.get(output_arns, ["QueueSummaryList", queue.get("text"), "Id"])
+
+            print(f"Replaced a queue reference with {new_arn}")
+            template["Resources"][resource]["Properties"]["Content"]["Fn::Sub"][0] =\
+                template["Resources"][resource]["Properties"]["Content"]["Fn::Sub"][0].replace(source, new_arn)
+
+
+# There are default audio prompts that come with a Connect instance
+# map the identifiers to the destination Connect instance.
+# Queues can be exported as well, so they are mapped by replace_queue_ids() once every resource has been exported.
 def replace_with_mappings(content):
     content = replace_with_config_mappings(content)
     contact_flow = json.loads(content)
@@ -496,7 +760,6 @@ def replace_with_mappings(content):
     for flow_command in metadata:
         action = metadata[flow_command]
         content = replace_with_mappings_audio_prompt(content, action)
-        content = replace_with_mappings_queue(content, action)
     return content
 
 
@@ -514,21 +777,9 @@ def replace_with_mappings_audio_prompt(content, action):
                 text = _.get(audio, "text")
                 source_id = _.get(audio, "id").split("/")[-1]
                 dest_id = _.get(output_arns, ["PromptSummaryList", text, "Id"])
-                content = content.replace(source_id, dest_id)
-
-    return content
-
-
-def replace_with_mappings_queue(content, action):
-    print("Remapping queue identifiers based on the manifest file...")
-    if "queue" in action:
-        text = _.get(action, "queue.text")
-        queue_id = _.get(action, "queue.id")
-        if(queue_id is not None):
-            source_id = queue_id.split("/")[-1]
-            dest_id = _.get(output_arns, ["QueueSummaryList", text, "Id"])
-            if dest_id is not None:
-                content = content.replace(source_id, dest_id)
+                # unresolved prompts are reported by validate_references()
+                if dest_id is not None:
+                    content = content.replace(source_id, dest_id)
 
     return content
 
@@ -541,6 +792,166 @@ def replace_pseudo_parms(content):
     return content
 
 
+# Resource references that are set from a contact attribute are resolved by Connect at runtime
+def is_dynamic_reference(value):
+    return isinstance(value, str) and value.startswith("$.")
+
+
+# Checks a single contact flow action against the manifest file and the resources that were exported.
+# Returns a list of the references that can not be resolved.
+def validate_action(action, action_metadata):
+    failures = []
+    parameters = action.get("Parameters", {})
+
+    if action["Type"] in ["TransferToFlow", "UpdateContactEventHooks"]:
+        if action["Type"] == "TransferToFlow":
+            contact_flow_arn = parameters.get("ContactFlowId")
+        else:
+            contact_flow_arn = _.get(parameters, "EventHooks.CustomerQueue")
+        if contact_flow_arn is not None and not is_dynamic_reference(contact_flow_arn) \
+                and contact_flow_arn.split("/")[-1] not in contact_flows:
+            contact_flow_name = _.get(action_metadata, "contactFlow.text", contact_flow_arn)
+            failures.append(f"the contact flow {contact_flow_name} was not exported")
+
+    if action["Type"] == "InvokeFlowModule":
+        module_id = parameters.get("FlowModuleId")
+        if module_id not in contact_flow_modules and not is_dynamic_reference(module_id):
+            module_name = action_metadata.get("contactFlowModuleName") or get_source_module_name(module_id)
+            if _.get(output_arns, ["ContactFlowModulesSummaryList", module_name, "Id"]) is None:
+                failures.append(f"the contact flow module {module_name or module_id} was not exported " +
+                                "and was not found in the manifest file")
+
+    if action["Type"] == "CheckHoursOfOperation" and "Hours" in parameters:
+        hours_arn = parameters["Hours"]
+        if not is_dynamic_reference(hours_arn) and hours_arn.split("/")[-1] not in hours_of_operations:
+            failures.append(f"the hours of operation {hours_arn} were not exported")
+
+    if action["Type"] == "InvokeLambdaFunction":
+        lambda_arn = parameters.get("LambdaFunctionARN")
+        if not is_dynamic_reference(lambda_arn) \
+                and (lambda_arn is None or not re.match(r'^arn:.+:lambda:.+:function:[^:]+', lambda_arn)):
+            failures.append(f"the Lambda function ARN {lambda_arn} is not valid")
+
+    alias_arn = _.get(parameters, "LexV2Bot.AliasArn")
+    if action["Type"] == "ConnectParticipantWithLexBot" and not action_metadata.get("useDynamicLexBotArn") \
+            and not is_dynamic_reference(alias_arn):
+        bot_name = action_metadata.get("lexV2BotName")
+        alias_name = action_metadata.get("lexV2BotAliasName")
+        if alias_arn is None or len(alias_arn.split(":")[-1].split("/")) != 3:
+            failures.append("the action does not reference a Lex V2 bot alias")
+        elif bot_name is None or alias_name is None:
+            failures.append("the Lex bot and alias names are not in the action metadata")
+        else:
+            dest_bot = _.get(output_arns, ["LexBotSummaries", bot_name])
+            if dest_bot is None:
+                failures.append(f"the Lex bot {bot_name} was not found in the manifest file")
+            elif alias_name not in [alias["botAliasName"] for alias in dest_bot["botAliases"]]:
+                failures.append(f"the Lex bot alias {bot_name}:{alias_name} was not found in the manifest file")
+
+    # replace_with_mappings() must have replaced the source identifier with the one from the manifest file
+    for audio in action_metadata.get("audio", []):
+        if _.get(audio, "type") != "Prompt":
+            continue
+        dest_id = _.get(output_arns, ["PromptSummaryList", _.get(audio, "text"), "Id"])
+        if dest_id is None:
+            failures.append(f"the prompt {_.get(audio, 'text')} was not found in the manifest file")
+        elif str(_.get(audio, "id")).split("/")[-1] != dest_id:
+            failures.append(f"the prompt {_.get(audio, 'text')} still references the source identifier")
+
+    # replace_queue_ids() references the exported queues and maps the others with the manifest file
+    queue = action_metadata.get("queue")
+    if isinstance(queue, dict) and queue.get("id") is not None and not is_dynamic_reference(queue["id"]) \
+            and queue["id"].split("/")[-1] not in queues \
+            and _.get(output_arns, ["QueueSummaryList", queue.get("text"), "Id"]) is None:
+        failures.append(f"the queue {queue.get('text')} was not exported and was not found in the manifest file")
+
+    return failures
+
+
+# Checks every prompt, queue, phone number, contact flow, module, hours of operation, Lambda and Lex
+# reference in the template before the references are replaced.
+#
+# The replace_* functions either skip a reference they can not resolve or stop at the first one,
+# and anything they miss is only found after CloudFormation rolls back the stack.  Each content is parsed
+# once and checked against the manifest file and the exported resources, so no API calls are made.
+def validate_references():
+    print("Validating resource references...")
+    failures = []
+
+    # target phone numbers must exist in the destination Connect instance
+    missing_phone_numbers = [target_phone for target_phone in phone_number_mappings.values()
+                             if target_phone not in output_arns.get("PhoneNumberSummaryList", {})]
+
+    for resource in template["Resources"]:
+        if "Content" not in template["Resources"][resource]["Properties"]:
+            continue
+        content_string = template["Resources"][resource]["Properties"]["Content"]["Fn::Sub"]
+        content = json.loads(content_string)
+        metadata = _.get(content, "Metadata.ActionMetadata", {})
+        unmapped_phone_numbers = [phone for phone in missing_phone_numbers if phone in content_string]
+
+        for action in content["Actions"]:
+            action_failures = validate_action(action, metadata.get(action["Identifier"], {}))
+            if unmapped_phone_numbers:
+                parameters = json.dumps(action.get("Parameters", {}))
+                action_failures += [f"the phone number {phone} was not found in the manifest file"
+                                    for phone in unmapped_phone_numbers if phone in parameters]
+            failures += [f"{resource} action {action['Identifier']}: {failure}" for failure in action_failures]
+
+    for failure in failures:
+        print(f"Error: {failure}")
+    if failures:
+        raise Exception(f"Found {len(failures)} unresolved references in the template. See the errors above.")
+
+
+# The flow editor lays the blocks out on the canvas from these, contact flows run without them
+def strip_layout_metadata(content):
+    metadata = content.get("Metadata", {})
+    metadata.pop("entryPointPosition", None)
+    metadata.pop("snapToGrid", None)
+    for action_metadata in metadata.get("ActionMetadata", {}).values():
+        action_metadata.pop("position", None)
+
+
+# Returns a copy of the template with minified contact flow content, and optionally without the layout metadata.
+# The template that is deployed with --deploy is not changed, so the layout is kept in the destination instance.
+def compact_template(strip_metadata):
+    print("Compacting contact flow content...")
+    compacted = copy.deepcopy(template)
+    total_saved = 0
+    for resource in compacted["Resources"]:
+        properties = compacted["Resources"][resource]["Properties"]
+        if "Content" not in properties:
+            continue
+        sub = properties["Content"]["Fn::Sub"]
+        content_string = sub[0] if isinstance(sub, list) else sub
+
+        content = json.loads(content_string)
+        if strip_metadata:
+            strip_layout_metadata(content)
+        compact_content_string = json.dumps(content, separators=(",", ":"), ensure_ascii=False)
+
+        if isinstance(sub, list):
+            sub[0] = compact_content_string
+        else:
+            properties["Content"]["Fn::Sub"] = compact_content_string
+
+        size = len(content_string.encode())
+        compact_size = len(compact_content_string.encode())
+        total_saved += size - compact_size
+        print(f"{resource}: {size} -> {compact_size} bytes ({100 * (size - compact_size) // max(size, 1)}% smaller)")
+    print(f"Saved {total_saved} bytes of contact flow content")
+    return compacted
+
+
+parser = argparse.ArgumentParser(description="Exports contact flows from a Connect instance to a CloudFormation template")
+parser.add_argument("--resume", action="store_true",
+                    help="continue an export that did not finish from its journal file")
+parser.add_argument("--deploy", action="store_true",
+                    help="create or update the contact flows, modules and hours of operation directly in the " +
+                         "destination Connect instance instead of through CloudFormation")
+args = parser.parse_args()
+
 # config.json contains the configuration information needed by the rest of the script
 
 print("Reading configuration from config.json file")
@@ -604,27 +1015,181 @@ print("Current partition {partition}")
 contact_flows = {}
 contact_flow_modules = {}
 hours_of_operations = {}
+queues = {}
+routing_profiles = {}
 quick_connects = {}
 
-# Currently, the script exporting:
+# Describes how each resource type is read from the source Connect instance and added to the template.
+#   ListApi / ListParameters / SummaryList - the paginated list call and the key of its results
+#   DescribeApi / IdParameter / DescribeResult - the describe call and the key of its result
+#   ExcludedProperties - returned by the describe call but not supported by CloudFormation
+#   Describe - makes any additional API calls needed to describe the resource
+#   Transform - maps the properties to the destination instance, returns any additional resources
+#   ResourceNames - the id -> CF resource name mapping
+#   ReferencedTypes - the resource types referenced by the properties, their names are listed even if not exported
+#   SourceNames - the id -> name mapping of every resource that was listed
+# References between resources are resolved by resolve_deferred_arns() once every resource has been exported.
+resource_specs = {
+    "HoursOfOperation": {
+        "ListApi": "list_hours_of_operations",
+        "ListParameters": {},
+        "SummaryList": "HoursOfOperationSummaryList",
+        "DescribeApi": "describe_hours_of_operation",
+        "IdParameter": "HoursOfOperationId",
+        "DescribeResult": "HoursOfOperation",
+        "ExcludedProperties": ["Id", "Arn", "ResponseMetadata", "InstanceId", "HoursOfOperationId",
+                               "HoursOfOperationArn", "Tags", "Description"],
+        "ResourceType": "AWS::Connect::HoursOfOperation",
+        "ResourceNameSuffix": "HoursOfOperation",
+        "ArnAttribute": "HoursOfOperationArn",
+        "Describe": None,
+        "Transform": None,
+        "ResourceNames": hours_of_operations,
+        "ReferencedTypes": [],
+        "SourceNames": {}
+    },
+    "ContactFlow": {
+        "ListApi": "list_contact_flows",
+        "ListParameters": {"ContactFlowTypes": ['CONTACT_FLOW',
+                                                'CUSTOMER_QUEUE',
+                                                'CUSTOMER_HOLD',
+                                                'CUSTOMER_WHISPER',
+                                                'AGENT_HOLD',
+                                                'AGENT_WHISPER',
+                                                'OUTBOUND_WHISPER',
+                                                'AGENT_TRANSFER',
+                                                'QUEUE_TRANSFER']},
+        "SummaryList": "ContactFlowSummaryList",
+        "DescribeApi": "describe_contact_flow",
+        "IdParameter": "ContactFlowId",
+        "DescribeResult": "ContactFlow",
+        "ExcludedProperties": ["Id", "Arn", "ResponseMetadata", "InstanceId", "Tags", "Description", "Status"],
+        "ResourceType": "AWS::Connect::ContactFlow",
+        "ResourceNameSuffix": "",
+        "ArnAttribute": "ContactFlowArn",
+        "Describe": None,
+        "Transform": transform_contact_flow,
+        "ResourceNames": contact_flows,
+        "ReferencedTypes": [],
+        "SourceNames": {}
+    },
+    "ContactFlowModule": {
+        "ListApi": "list_contact_flow_modules",
+        "ListParameters": {"ContactFlowModuleState": "active"},
+        "SummaryList": "ContactFlowModulesSummaryList",
+        "DescribeApi": "describe_contact_flow_module",
+        "IdParameter": "ContactFlowModuleId",
+        "DescribeResult": "ContactFlowModule",
+        "ExcludedProperties": ["Id", "Arn", "ResponseMetadata", "InstanceId", "Status", "Tags", "Description"],
+        "ResourceType": "AWS::Connect::ContactFlowModule",
+        "ResourceNameSuffix": "Module",
+        "ArnAttribute": "ContactFlowModuleArn",
+        "Describe": None,
+        "Transform": transform_contact_flow_module,
+        "ResourceNames": contact_flow_modules,
+        "ReferencedTypes": [],
+        "SourceNames": {}
+    },
+    "Queue": {
+        "ListApi": "list_queues",
+        "ListParameters": {"QueueTypes": ["STANDARD"]},
+        "SummaryList": "QueueSummaryList",
+        "DescribeApi": "describe_queue",
+        "IdParameter": "QueueId",
+        "DescribeResult": "Queue",
+        "ExcludedProperties": ["QueueId", "QueueArn", "ResponseMetadata", "InstanceId", "HoursOfOperationId", "Tags",
+                               "LastModifiedTime", "LastModifiedRegion"],
+        "ResourceType": "AWS::Connect::Queue",
+        "ResourceNameSuffix": "Queue",
+        "ArnAttribute": "QueueArn",
+        "Describe": describe_queue_phone_number,
+        "Transform": transform_queue,
+        "ResourceNames": queues,
+        "ReferencedTypes": ["HoursOfOperation", "ContactFlow"],
+        "SourceNames": {}
+    },
+    "RoutingProfile": {
+        "ListApi": "list_routing_profiles",
+        "ListParameters": {},
+        "SummaryList": "RoutingProfileSummaryList",
+        "DescribeApi": "describe_routing_profile",
+        "IdParameter": "RoutingProfileId",
+        "DescribeResult": "RoutingProfile",
+        "ExcludedProperties": ["RoutingProfileId", "RoutingProfileArn", "ResponseMetadata", "InstanceId",
+                               "DefaultOutboundQueueId", "Tags", "NumberOfAssociatedQueues",
+                               "NumberOfAssociatedUsers", "AssociatedQueueIds", "IsDefault",
+                               "LastModifiedTime", "LastModifiedRegion"],
+        "ResourceType": "AWS::Connect::RoutingProfile",
+        "ResourceNameSuffix": "RoutingProfile",
+        "ArnAttribute": "RoutingProfileArn",
+        "Describe": describe_routing_profile_queues,
+        "Transform": transform_routing_profile,
+        "ResourceNames": routing_profiles,
+        "ReferencedTypes": ["Queue"],
+        "SourceNames": {}
+    },
+    "QuickConnect": {
+        "ListApi": "list_quick_connects",
+        "ListParameters": {"QuickConnectTypes": ["QUEUE", "PHONE_NUMBER"]},
+        "SummaryList": "QuickConnectSummaryList",
+        "DescribeApi": "describe_quick_connect",
+        "IdParameter": "QuickConnectId",
+        "DescribeResult": "QuickConnect",
+        "ExcludedProperties": ["QuickConnectId", "QuickConnectARN", "ResponseMetadata", "Tags", "Description",
+                               "LastModifiedTime", "LastModifiedRegion"],
+        "ResourceType": "AWS::Connect::QuickConnect",
+        "ResourceNameSuffix": "QuickConnect",
+        "ArnAttribute": "QuickConnectArn",
+        "Describe": None,
+        "Transform": transform_quick_connect,
+        "ResourceNames": quick_connects,
+        "ReferencedTypes": ["Queue", "ContactFlow"],
+        "SourceNames": {}
+    }
+}
+
+# By default the script exports:
 #   - hours of operation
 #   - contact flow
 #   - contact flow modules
+# Queues, routing profiles and quick connects are exported when they are listed in ResourceFilters->ResourceTypes
+resource_types = _.get(config, "ResourceFilters.ResourceTypes", ["HoursOfOperation", "ContactFlow", "ContactFlowModule"])
 
+# the number of resources that are described and transformed at the same time
+max_concurrency = _.get(config, "Input.MaxConcurrency", 5)
 
 connect_arn = replace_pseudo_parms(connect_arn)
 
-for name in config["ResourceFilters"]["ContactFlows"]:
-    # export_quick_connects(name,"AWS::Connect::QuickConnect")
-    export_hours_of_operation(name, "AWS::Connect::HoursOfOperation")
-    export_contact_flow(name, "AWS::Connect::ContactFlow")
-    export_contact_flow_modules(name, "AWS::Connect::ContactFlowModule")
+# resources that were exported by a previous run that did not finish
+journal_file_name = os.path.join(sys.path[0], _.get(config, "Output.JournalFileName",
+                                                    config["Output"]["Filename"] + ".journal"))
+journal_entries = open_journal(journal_file_name, args.resume)
+
+# contact flows and modules that were transformed before, in this run or an earlier one
+transform_cache_file_name = _.get(config, "Output.TransformCacheFileName")
+transform_cache = TransformCache(
+    os.path.join(sys.path[0], transform_cache_file_name) if transform_cache_file_name else None,
+    _.get(config, "Output.TransformCacheMaxEntries", 1000))
+transform_inputs_hash = None
+
+# the cache is saved even if the export fails, so the contact flows that were transformed are not lost
+try:
+    export_resources([spec for resource_type, spec in resource_specs.items() if resource_type in resource_types],
+                     config["ResourceFilters"]["ContactFlows"])
+finally:
+    transform_cache.save()
+
+# References between resources are patched once every resource has been exported
+resolve_deferred_arns()
 
+# Report every reference that can not be resolved before any of them are replaced
+validate_references()
 
 replace_contact_flowids()
 replace_contact_module_flowids()
 replace_lexbot_ids()
 replace_hours_of_operation()
+replace_queue_ids()
 
 # Add the parameters section to the CloudFormation template
 template["Parameters"] = {
@@ -635,5 +1200,29 @@ template["Parameters"] = {
     }
 }
 
-with open(os.path.join(sys.path[0], config["Output"]["Filename"]), 'w') as f:
-    json.dump(template, f, indent=4, default=str)
+# Output->CompactOutput writes minified JSON, Output->StripLayoutMetadata removes the canvas positions from
+# the contact flows.  Both make the template smaller so more contact flows fit in a stack.
+compact_output = _.get(config, "Output.CompactOutput", False)
+strip_layout = _.get(config, "Output.StripLayoutMetadata", False)
+output_template = compact_template(strip_layout) if compact_output or strip_layout else template
+
+with open(os.path.join(sys.path[0], config["Output"]["Filename"]), 'w', encoding="utf-8") as f:
+    if compact_output:
+        json.dump(output_template, f, separators=(",", ":"), ensure_ascii=False, default=str)
+    else:
+        json.dump(output_template, f, indent=4, default=str)
+print(f"Wrote {os.path.getsize(os.path.join(sys.path[0], config['Output']['Filename']))} bytes " +
+      f"to {config['Output']['Filename']}")
+
+# the export finished, there is nothing left to resume
+journal.close()
+os.remove(journal_file_name)
+
+# Deploy to the destination instance with the Connect APIs, using the credentials of Output->DeployProfileName
+if args.deploy:
+    deploy_session = boto3.Session(profile_name=_.get(config, "Output.DeployProfileName"))
+    deploy_client = deploy_session.client('connect', region_name=deploy_session.region_name or region)
+    print(f"Deploying to Connect instance {config['Output']['ConnectInstanceId']}")
+    results = deploy_template(template, deploy_client, config["Output"]["ConnectInstanceId"], max_concurrency)
+    if "FAILED" in results.values():
+        raise Exception("Some resources could not be deployed. See the errors above.")
@@ -0,0 +1,240 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+# Tests connect_deployer.py against a stubbed Connect client.  Run with: python -m pytest tests
+
+import json
+import os
+import sys
+import unittest
+import boto3
+from botocore.stub import Stubber, ANY
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from connect_deployer import deploy_template  # noqa: E402
+
+INSTANCE_ID = "11111111-2222-3333-4444-555555555555"
+INSTANCE_ARN = f"arn:aws:connect:eu-west-2:123456789012:instance/{INSTANCE_ID}"
+LAMBDA_ARN = "arn:aws:lambda:eu-west-2:123456789012:function:lookup"
+ALIAS_ARN = "arn:aws:lex:eu-west-2:123456789012:bot-alias/BOTID/ALIASID"
+HOURS_CONFIG = [
+    {"Day": "MONDAY", "StartTime": {"Hours": 9, "Minutes": 0}, "EndTime": {"Hours": 17, "Minutes": 0}},
+    {"Day": "TUESDAY", "StartTime": {"Hours": 9, "Minutes": 0}, "EndTime": {"Hours": 17, "Minutes": 0}}
+]
+
+
+def flow_arn(flow_id):
+    return f"{INSTANCE_ARN}/contact-flow/{flow_id}"
+
+
+def module_arn(module_id):
+    return f"{INSTANCE_ARN}/flow-module/{module_id}"
+
+
+# Content that transfers to each of the given template resources, and optionally invokes a Lambda function
+def get_content(*references, lambda_arn=None):
+    actions = [{"Identifier": "start", "Type": "DisconnectParticipant", "Parameters": {}, "Transitions": {}}]
+    actions += [{"Identifier": reference, "Type": "TransferToFlow",
+                 "Parameters": {"ContactFlowId": f"${{{reference}.ContactFlowArn}}"}, "Transitions": {}}
+                for reference in references]
+    if lambda_arn is not None:
+        actions.append({"Identifier": "lambda", "Type": "InvokeLambdaFunction",
+                        "Parameters": {"LambdaFunctionARN": lambda_arn}, "Transitions": {}})
+    return {"Fn::Sub": json.dumps({"Version": "2019-10-30", "StartAction": "start", "Actions": actions})}
+
+
+# The content after the references have been replaced with the ARNs of the given flow ids
+def get_rendered_content(lambda_arn=None, **flow_ids):
+    content = get_content(*flow_ids, lambda_arn=lambda_arn)["Fn::Sub"]
+    for reference, flow_id in flow_ids.items():
+        content = content.replace(f"${{{reference}.ContactFlowArn}}", flow_arn(flow_id))
+    return content
+
+
+def get_flow(name, references=(), lambda_arn=None, state="ACTIVE"):
+    return {
+        "Type": "AWS::Connect::ContactFlow",
+        "Properties": {
+            "InstanceArn": {"Fn::Sub": "arn:${AWS::Partition}:connect:${AWS::Region}:${AWS::AccountId}:instance/${ConnectInstanceID}"},
+            "Name": name,
+            "Type": "CONTACT_FLOW",
+            "State": state,
+            "Content": get_content(*references, lambda_arn=lambda_arn)
+        }
+    }
+
+
+def get_template(**flows):
+    return {"Resources": {name: get_flow(name, references) for name, references in flows.items()}}
+
+
+class TestDeployTemplate(unittest.TestCase):
+    def setUp(self):
+        self.client = boto3.client("connect", region_name="eu-west-2",
+                                   aws_access_key_id="testing", aws_secret_access_key="testing")
+        self.stubber = Stubber(self.client)
+        self.stubber.activate()
+
+    def tearDown(self):
+        self.stubber.deactivate()
+
+    def stub(self, method, response, expected_params):
+        self.stubber.add_response(method, response, dict(expected_params, InstanceId=INSTANCE_ID))
+
+    # The calls every deployment starts with.  The existing resources map the names of the resources in the
+    # instance to their ids, the associations are the ARNs that are already associated with the instance.
+    def stub_listing(self, existing_flows=None, existing_modules=None, existing_hours=None,
+                     lambda_functions=None, lex_bots=None):
+        self.stub('describe_instance', {"Instance": {"Arn": INSTANCE_ARN}}, {})
+        self.stub('list_contact_flows', {"ContactFlowSummaryList": [
+            {"Id": flow_id, "Arn": flow_arn(flow_id), "Name": name, "ContactFlowState": "ACTIVE"}
+            for name, flow_id in (existing_flows or {}).items()
+        ]}, {"MaxResults": 50})
+        self.stub('list_contact_flow_modules', {"ContactFlowModulesSummaryList": [
+            {"Id": module_id, "Arn": module_arn(module_id), "Name": name, "State": "ACTIVE"}
+            for name, module_id in (existing_modules or {}).items()
+        ]}, {"MaxResults": 50})
+        self.stub('list_hours_of_operations', {"HoursOfOperationSummaryList": [
+            {"Id": hours_id, "Arn": f"{INSTANCE_ARN}/operating-hours/{hours_id}", "Name": name}
+            for name, hours_id in (existing_hours or {}).items()
+        ]}, {"MaxResults": 50})
+        self.stub('list_lambda_functions', {"LambdaFunctions": lambda_functions or []}, {})
+        self.stub('list_bots', {"LexBots": [{"LexV2Bot": {"AliasArn": alias_arn}} for alias_arn in lex_bots or []]},
+                  {"LexVersion": "V2"})
+
+    def stub_create(self, name, flow_id, content=ANY):
+        self.stub('create_contact_flow', {"ContactFlowId": flow_id, "ContactFlowArn": flow_arn(flow_id)},
+                  {"Name": name, "Type": "CONTACT_FLOW", "Content": content})
+
+    def stub_describe(self, flow_id, content):
+        self.stub('describe_contact_flow', {"ContactFlow": {"Content": content}}, {"ContactFlowId": flow_id})
+
+    def stub_update(self, flow_id, content):
+        self.stub('update_contact_flow_content', {}, {"ContactFlowId": flow_id, "Content": content})
+
+    def deploy(self, template):
+        results = deploy_template(template, self.client, INSTANCE_ID, max_workers=1)
+        self.stubber.assert_no_pending_responses()
+        return results
+
+    def test_create(self):
+        template = get_template(Main=["Transfer"], Transfer=[])
+        self.stub_listing()
+        self.stub_create("Transfer", "id-transfer", get_rendered_content())
+        self.stub_create("Main", "id-main", get_rendered_content(Transfer="id-transfer"))
+
+        self.assertEqual(self.deploy(template), {"Main": "CREATED", "Transfer": "CREATED"})
+
+    def test_unchanged(self):
+        template = get_template(Main=["Transfer"], Transfer=[])
+        self.stub_listing({"Main": "id-main", "Transfer": "id-transfer"})
+        self.stub_describe("id-main", get_rendered_content(Transfer="id-transfer"))
+        self.stub_describe("id-transfer", get_rendered_content())
+
+        self.assertEqual(self.deploy(template), {"Main": "UNCHANGED", "Transfer": "UNCHANGED"})
+
+    def test_cycle(self):
+        # A and B reference each other and C only references A, so only A and B need placeholders
+        template = get_template(A=["B"], B=["A"], C=["A"])
+        self.stub_listing()
+        self.stub_create("A", "id-a")
+        self.stub_create("B", "id-b")
+        self.stub_describe("id-a", get_rendered_content())
+        self.stub_update("id-a", get_rendered_content(B="id-b"))
+        self.stub_describe("id-b", get_rendered_content())
+        self.stub_update("id-b", get_rendered_content(A="id-a"))
+        self.stub_create("C", "id-c", get_rendered_content(A="id-a"))
+
+        self.assertEqual(self.deploy(template), {"A": "CREATED", "B": "CREATED", "C": "CREATED"})
+
+    def test_failure_only_blocks_dependents(self):
+        template = get_template(Main=["Broken"], Broken=[], Other=[])
+        self.stub_listing()
+        self.stubber.add_client_error('create_contact_flow', "InvalidContactFlowException",
+                                      expected_params={"InstanceId": INSTANCE_ID, "Name": "Broken",
+                                                       "Type": "CONTACT_FLOW", "Content": ANY})
+        self.stub_create("Other", "id-other", get_rendered_content())
+
+        self.assertEqual(self.deploy(template), {"Main": "FAILED", "Broken": "FAILED", "Other": "CREATED"})
+
+    def test_archived(self):
+        template = {"Resources": {"Old": get_flow("Old", state="ARCHIVED")}}
+        self.stub_listing()
+        self.stub_create("Old", "id-old", get_rendered_content())
+        self.stub('update_contact_flow_metadata', {}, {"ContactFlowId": "id-old", "ContactFlowState": "ARCHIVED"})
+
+        self.assertEqual(self.deploy(template), {"Old": "CREATED"})
+
+    def test_modules(self):
+        template = {"Resources": {
+            name: {
+                "Type": "AWS::Connect::ContactFlowModule",
+                "Properties": {"Name": name, "State": "ACTIVE", "Content": get_content()}
+            } for name in ["NewModule", "ChangedModule"]
+        }}
+        self.stub_listing(existing_modules={"ChangedModule": "id-changed"})
+        self.stub('create_contact_flow_module', {"Id": "id-new", "Arn": module_arn("id-new")},
+                  {"Name": "NewModule", "Content": get_rendered_content()})
+        self.stub('describe_contact_flow_module', {"ContactFlowModule": {"Content": get_rendered_content(LAMBDA_ARN)}},
+                  {"ContactFlowModuleId": "id-changed"})
+        self.stub('update_contact_flow_module_content', {},
+                  {"ContactFlowModuleId": "id-changed", "Content": get_rendered_content()})
+
+        self.assertEqual(self.deploy(template), {"NewModule": "CREATED", "ChangedModule": "UPDATED"})
+
+    def test_hours_of_operation_unchanged(self):
+        template = {"Resources": {"OfficeHours": {
+            "Type": "AWS::Connect::HoursOfOperation",
+            "Properties": {"Name": "Office", "TimeZone": "Europe/London", "Config": HOURS_CONFIG}
+        }}}
+        self.stub_listing(existing_hours={"Office": "id-office"})
+        # the API does not return the days in the same order
+        self.stub('describe_hours_of_operation',
+                  {"HoursOfOperation": {"TimeZone": "Europe/London", "Config": list(reversed(HOURS_CONFIG))}},
+                  {"HoursOfOperationId": "id-office"})
+
+        self.assertEqual(self.deploy(template), {"OfficeHours": "UNCHANGED"})
+
+    def test_associations(self):
+        template = {"Resources": {
+            "Main": get_flow("Main", lambda_arn=LAMBDA_ARN),
+            "lookupLambdaPermission": {
+                "Type": "Custom::ConnectAssociateLambda",
+                "Properties": {"FunctionArn": {"Fn::Sub": LAMBDA_ARN}}
+            },
+            "BotLexPermission": {
+                "Type": "Custom::ConnectAssociateLex",
+                "Properties": {"AliasArn": {"Fn::Sub": ALIAS_ARN}}
+            }
+        }}
+        self.stub_listing(lex_bots=[ALIAS_ARN])
+        self.stub('associate_lambda_function', {}, {"FunctionArn": LAMBDA_ARN})
+        self.stub_create("Main", "id-main", get_rendered_content(LAMBDA_ARN))
+
+        self.assertEqual(self.deploy(template),
+                         {"lookupLambdaPermission": "CREATED", "BotLexPermission": "UNCHANGED", "Main": "CREATED"})
+
+    def test_failed_association_blocks_flows(self):
+        template = {"Resources": {
+            "Main": get_flow("Main", lambda_arn=LAMBDA_ARN),
+            "Other": get_flow("Other"),
+            "lookupLambdaPermission": {
+                "Type": "Custom::ConnectAssociateLambda",
+                "Properties": {"FunctionArn": {"Fn::Sub": LAMBDA_ARN}}
+            }
+        }}
+        self.stub_listing()
+        self.stubber.add_client_error('associate_lambda_function', "AccessDeniedException",
+                                      expected_params={"InstanceId": INSTANCE_ID, "FunctionArn": LAMBDA_ARN})
+        self.stub_create("Other", "id-other", get_rendered_content())
+        created = []
+        self.client.meta.events.register('provide-client-params.connect.CreateContactFlow',
+                                         lambda params, **kwargs: created.append(params["Name"]))
+
+        self.assertEqual(self.deploy(template),
+                         {"lookupLambdaPermission": "FAILED", "Main": "FAILED", "Other": "CREATED"})
+        self.assertEqual(created, ["Other"])
+
+
+if __name__ == "__main__":
+    unittest.main()